@@ -1,6 +1,7 @@
 """Lambda function to handel creation and deletion of FSx."""
 import os
 import random
+import hashlib
 import datetime
 import logging
 import boto3
@@ -23,6 +24,20 @@ EVENTS_CLIENT: object = boto3.client('events')
 # -- Environment varaibles --
 EVENT_NAME_PREFIX: str = os.environ.get('EVENT_NAME_PREFIX')
 
+# -- Data repository settings --
+DEFAULT_IMPORT_POLICY: str = 'NEW_CHANGED'
+DEFAULT_DEPLOYMENT_TYPE: str = 'SCRATCH_2'
+DEPLOYMENT_TYPES: tuple = ('SCRATCH_2', 'PERSISTENT_2')
+MAX_ASSOCIATIONS: int = 8
+MAX_TOKEN_LENGTH: int = 63
+NON_RETRYABLE_ERRORS: tuple = ('BadRequest', 'IncompatibleParameterError', 'UnsupportedOperation')
+AUTO_IMPORT_EVENTS: dict = {
+    'NONE': [],
+    'NEW': ['NEW'],
+    'NEW_CHANGED': ['NEW', 'CHANGED'],
+    'NEW_CHANGED_DELETED': ['NEW', 'CHANGED', 'DELETED']
+}
+
 def lambda_handler(event: dict, context: object):
     """Main method called when function is invoked. Orchestrates actions
        to perform based on operation.
@@ -52,7 +67,11 @@ def lambda_handler(event: dict, context: object):
         raise ex
 
 def create_file_system(event) -> dict:
-    """Creates a new FSx file system with the boto3 client.
+    """Creates a new FSx file system with the boto3 client. SCRATCH_2 file systems
+       import the team prefix, or a single scoped prefix, through ImportPath.
+       PERSISTENT_2 file systems are created without an import path, the data
+       repository associations for each prefix are created by get_status once
+       the file system is available.
     Args:
         event (dict): The invocation event passed to the lambda function.
     Raises:
@@ -68,11 +87,46 @@ def create_file_system(event) -> dict:
         security_group: str = random.choice(os.environ['SECURITY_GROUPS'].split(","))
         LOGGER.info('Using subnet (%s) and Security group (%s).', subnet, security_group)
 
-        import_path: str = f's3://{event["bucket"]}/{event["team"]}'
+        prefixes: list = get_prefixes(event)
+        get_critical_prefixes(event, prefixes)
+        import_policy: str = get_import_policy(event)
+        deployment_type: str = get_deployment_type(event)
         fsx_name: str = f'{event["team"]}-{event["bucket"]}'
+        request_token: str = fsx_name
+
+        if (prefixes or import_policy != DEFAULT_IMPORT_POLICY
+                or deployment_type != DEFAULT_DEPLOYMENT_TYPE):
+            # -- Different import settings must not reuse the same idempotency token --
+            digest: str = hashlib.sha1(
+                f'{deployment_type}|{import_policy}|{",".join(prefixes)}'.encode()
+            ).hexdigest()
+            request_token = f'{fsx_name[:MAX_TOKEN_LENGTH - 9]}-{digest[:8]}'
+
+        if deployment_type == 'PERSISTENT_2':
+            if len(prefixes) > MAX_ASSOCIATIONS:
+                raise ValueError(f'At most {MAX_ASSOCIATIONS} prefixes are supported, '
+                                 f'got {len(prefixes)}')
+
+            lustre_config: dict = {
+                'DeploymentType': deployment_type,
+                'PerUnitStorageThroughput': 125
+            }
+
+        elif len(prefixes) > 1:
+            raise ValueError(f'{deployment_type} supports a single import prefix, '
+                             'use PERSISTENT_2 for multiple prefixes')
+
+        else:
+            import_path: str = get_data_repository_path(event, prefixes[0] if prefixes else '')
+            LOGGER.info('Using import path %s.', import_path)
+            lustre_config: dict = {
+                'DeploymentType': deployment_type,
+                'ImportPath': import_path,
+                'AutoImportPolicy': import_policy
+            }
 
         response: dict = FSX_CLIENT.create_file_system(
-            ClientRequestToken=fsx_name,
+            ClientRequestToken=request_token,
             FileSystemType='LUSTRE',
             StorageCapacity=4800,
             StorageType='SSD',
@@ -84,11 +138,7 @@ def create_file_system(event) -> dict:
                 { 'Key': 'CreatedBy',   'Value': "MLOps"},
                 { 'Key': 'CreatedAt',   'Value': str(datetime.datetime.now())}
             ],
-            LustreConfiguration={
-                'DeploymentType': 'SCRATCH_2',
-                'ImportPath': import_path,
-                'AutoImportPolicy': 'NEW_CHANGED'
-            }
+            LustreConfiguration=lustre_config
         )
 
         handleResponse(response)
@@ -121,15 +171,19 @@ def create_file_system(event) -> dict:
         LOGGER.error('Value Error: %s', val_ex)
         raise val_ex
 
-def get_status(event: dict) -> str:
-    """Get the status from the FSx lifecycle with boto3.
+def get_status(event: dict) -> dict:
+    """Get the status from the FSx lifecycle with boto3. For PERSISTENT_2 file
+       systems, the missing data repository associations are created once the
+       file system is available and their lifecycles are reported per prefix.
+       The overall status is AVAILABLE once every critical prefix is loaded.
     Args:
         event (dict): The invocation event passed to the lambda function.
     Raises:
         fsx_ex: Errors from the boto3 client.
         key_ex: Python error when a key in a mapping is not found.
+        val_ex: Python error when there exists a wrong value.
     Returns:
-        str: The FSx status.
+        dict: The overall FSx status and the import status of each prefix.
     """
     try:
         response: dict = FSX_CLIENT.describe_file_systems(
@@ -139,10 +193,129 @@ def get_status(event: dict) -> str:
         )
 
         handleResponse(response)
-        config: dict = response['FileSystems'][0]['LustreConfiguration']
-        status: str = config['DataRepositoryConfiguration']['Lifecycle']
+        file_system: dict = response['FileSystems'][0]
+        config: dict = file_system['LustreConfiguration']
+        prefixes: list = get_prefixes(event)
+        critical: list = get_critical_prefixes(event, prefixes)
+
+        if config['DeploymentType'] != 'PERSISTENT_2':
+            status: str = config['DataRepositoryConfiguration']['Lifecycle']
 
-        return status
+            return {
+                'status': status,
+                'prefixes': {prefix: status for prefix in prefixes or ['']}
+            }
+
+        if file_system['Lifecycle'] != 'AVAILABLE':
+            status: str = file_system['Lifecycle']
+            if status == 'MISCONFIGURED_UNAVAILABLE':
+                status = 'MISCONFIGURED'
+
+            return {
+                'status': status,
+                'prefixes': {prefix: 'PENDING' for prefix in prefixes or ['']}
+            }
+
+        progress: dict = get_association_progress(event, prefixes or [''])
+        LOGGER.info('Import progress: %s', progress)
+
+        critical_states: list = [progress[prefix] for prefix in critical]
+        if any(state in ('FAILED', 'MISCONFIGURED') for state in critical_states):
+            status: str = 'MISCONFIGURED'
+
+        elif all(state == 'AVAILABLE' for state in critical_states):
+            status: str = 'AVAILABLE'
+
+        else:
+            status: str = 'CREATING'
+
+        return {
+            'status': status,
+            'prefixes': progress
+        }
+
+    except ClientError as fsx_ex:
+        LOGGER.error('Client Error: %s', fsx_ex)
+        raise fsx_ex
+
+    except KeyError as key_ex:
+        LOGGER.error('Key Error: %s', key_ex)
+        raise key_ex
+
+    except ValueError as val_ex:
+        LOGGER.error('Value Error: %s', val_ex)
+        raise val_ex
+
+def get_association_progress(event: dict, prefixes: list) -> dict:
+    """Creates the data repository associations missing for the prefixes and
+       returns the lifecycle of each association. A prefix whose association
+       is rejected is reported as FAILED, a prefix whose association failed
+       with a transient error is reported as CREATING and retried on the next poll.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+        prefixes (list): The prefixes, relative to the team, to associate.
+    Raises:
+        fsx_ex: Errors from the boto3 client.
+        key_ex: Python error when a key in a mapping is not found.
+        val_ex: Python error when there exists a wrong value.
+    Returns:
+        dict: The association lifecycle for each prefix.
+    """
+    try:
+        existing: dict = {}
+        dra_paginator = FSX_CLIENT.get_paginator('describe_data_repository_associations')
+        dra_iterator = dra_paginator.paginate(
+            Filters=[
+                {
+                    'Name': 'file-system-id',
+                    'Values': [event["file_system_id"]]
+                },
+            ]
+        )
+        for dra_page in dra_iterator:
+            for association in dra_page['Associations']:
+                existing[association['FileSystemPath']] = association['Lifecycle']
+
+        import_events: list = AUTO_IMPORT_EVENTS[get_import_policy(event)]
+        progress: dict = {}
+        for prefix in prefixes:
+            file_system_path: str = f'/{prefix}'
+
+            if file_system_path in existing:
+                progress[prefix] = existing[file_system_path]
+                continue
+
+            s3_config: dict = {}
+            if import_events:
+                s3_config['AutoImportPolicy'] = {'Events': import_events}
+
+            LOGGER.info('Associating %s with %s.', file_system_path, prefix)
+            try:
+                response: dict = FSX_CLIENT.create_data_repository_association(
+                    ClientRequestToken=hashlib.sha1(
+                        f'{event["file_system_id"]}{file_system_path}'.encode()
+                    ).hexdigest(),
+                    FileSystemId=event["file_system_id"],
+                    FileSystemPath=file_system_path,
+                    DataRepositoryPath=get_data_repository_path(event, prefix),
+                    BatchImportMetaDataOnCreate=True,
+                    S3=s3_config
+                )
+
+                handleResponse(response)
+                progress[prefix] = response['Association']['Lifecycle']
+
+            except ClientError as dra_ex:
+                # -- Let the critical prefixes decide if the import failed --
+                LOGGER.error('Client Error for prefix %s: %s', prefix, dra_ex)
+                error_code: str = dra_ex.response.get('Error', {}).get('Code')
+                if error_code in NON_RETRYABLE_ERRORS:
+                    progress[prefix] = 'FAILED'
+
+                else:
+                    progress[prefix] = 'CREATING'
+
+        return progress
 
     except ClientError as fsx_ex:
         LOGGER.error('Client Error: %s', fsx_ex)
@@ -152,6 +325,10 @@ def get_status(event: dict) -> str:
         LOGGER.error('Key Error: %s', key_ex)
         raise key_ex
 
+    except ValueError as val_ex:
+        LOGGER.error('Value Error: %s', val_ex)
+        raise val_ex
+
 def delete_file_system(event: dict) -> str:
     """Deletes the FSx file system.
     Args:
@@ -205,6 +382,96 @@ def enable_event():
         LOGGER.error('Key Error: %s', key_ex)
         raise key_ex
 
+def get_prefixes(event: dict, key: str = 'prefixes') -> list:
+    """Normalizes the prefixes, relative to the team, requested in the event.
+       Prefixes nested in one another can not be imported separately.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+        key (str): The event key holding the prefixes.
+    Raises:
+        ValueError: The prefixes are not a list of strings or overlap.
+    Returns:
+        list: The sorted, de-duplicated prefixes without leading or trailing slashes.
+    """
+    requested: list = event.get(key) or []
+
+    if not isinstance(requested, list) or not all(isinstance(p, str) for p in requested):
+        raise ValueError(f'{key} must be a list of strings, got {requested!r}')
+
+    prefixes: list = sorted({prefix.strip('/') for prefix in requested})
+
+    for parent in prefixes:
+        for child in prefixes:
+            if parent != child and (not parent or child.startswith(f'{parent}/')):
+                raise ValueError(f'Prefix {child} is nested in prefix {parent}')
+
+    return prefixes
+
+def get_critical_prefixes(event: dict, prefixes: list) -> list:
+    """Validates the critical prefixes requested in the event against the
+       imported prefixes.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+        prefixes (list): The normalized prefixes to import.
+    Raises:
+        ValueError: A critical prefix is not imported.
+    Returns:
+        list: The critical prefixes, all imported prefixes when none are requested.
+    """
+    imported: list = prefixes or ['']
+    critical: list = get_prefixes(event, 'critical_prefixes')
+    missing: list = [prefix for prefix in critical if prefix not in imported]
+
+    if missing:
+        raise ValueError(f'Critical prefixes {missing} are not in prefixes {imported}')
+
+    return critical or imported
+
+def get_deployment_type(event: dict) -> str:
+    """Validates the deployment type requested in the event.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+    Raises:
+        ValueError: The deployment type is not supported.
+    Returns:
+        str: The deployment type.
+    """
+    deployment_type: str = event.get('deployment_type') or DEFAULT_DEPLOYMENT_TYPE
+
+    if deployment_type not in DEPLOYMENT_TYPES:
+        raise ValueError(f'Invalid deployment type: {deployment_type}')
+
+    return deployment_type
+
+def get_import_policy(event: dict) -> str:
+    """Validates the auto import policy requested in the event.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+    Raises:
+        ValueError: The import policy is not supported.
+    Returns:
+        str: The auto import policy.
+    """
+    import_policy: str = event.get('import_policy') or DEFAULT_IMPORT_POLICY
+
+    if import_policy not in AUTO_IMPORT_EVENTS:
+        raise ValueError(f'Invalid import policy: {import_policy}')
+
+    return import_policy
+
+def get_data_repository_path(event: dict, prefix: str) -> str:
+    """Builds the S3 path of a prefix within the team folder.
+    Args:
+        event (dict): The invocation event passed to the lambda function.
+        prefix (str): The prefix relative to the team folder.
+    Returns:
+        str: The S3 data repository path.
+    """
+    if prefix:
+        return f's3://{event["bucket"]}/{event["team"]}/{prefix}/'
+
+    return f's3://{event["bucket"]}/{event["team"]}'
+
 def handleResponse(res: dict):
     """Handles 200 http reponses. If a response is not 200, its
        likely the expected behavior did not occur.
@@ -0,0 +1,203 @@
+"""Unit tests for the setup FSx function with a stubbed FSx client."""
+import os
+from unittest import mock
+import pytest
+from botocore.exceptions import ClientError
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('SUBNETS', 'subnet-1')
+os.environ.setdefault('SECURITY_GROUPS', 'sg-1')
+
+from functions.setup_fsx import app  # pylint: disable=wrong-import-position
+
+OK: dict = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+BASE_EVENT: dict = {'team': 'teamA', 'bucket': 'my-bucket'}
+
+
+@pytest.fixture(name='fsx_client')
+def fixture_fsx_client():
+    """Replaces the boto3 clients with stubs."""
+    client = mock.MagicMock()
+    client.create_file_system.return_value = {
+        **OK, 'FileSystem': {'FileSystemId': 'fs-1', 'ResourceARN': 'arn'}
+    }
+    client.get_paginator.return_value.paginate.return_value = [{'Associations': []}]
+    with mock.patch.object(app, 'FSX_CLIENT', client), \
+            mock.patch.object(app, 'enable_event'):
+        yield client
+
+
+def describe(client: mock.MagicMock, lifecycle: str, deployment_type: str = 'PERSISTENT_2'):
+    """Sets the describe_file_systems response of the stubbed client."""
+    client.describe_file_systems.return_value = {**OK, 'FileSystems': [{
+        'Lifecycle': lifecycle,
+        'LustreConfiguration': {
+            'DeploymentType': deployment_type,
+            'DataRepositoryConfiguration': {'Lifecycle': lifecycle}
+        }
+    }]}
+
+
+def client_error(code: str) -> ClientError:
+    """Builds a boto3 client error with the given code."""
+    return ClientError({'Error': {'Code': code, 'Message': code}},
+                       'CreateDataRepositoryAssociation')
+
+
+def test_default_event_matches_baseline(fsx_client):
+    assert app.create_file_system(dict(BASE_EVENT)) == {'id': 'fs-1'}
+
+    kwargs: dict = fsx_client.create_file_system.call_args.kwargs
+    assert kwargs['ClientRequestToken'] == 'teamA-my-bucket'
+    assert kwargs['LustreConfiguration'] == {
+        'DeploymentType': 'SCRATCH_2',
+        'ImportPath': 's3://my-bucket/teamA',
+        'AutoImportPolicy': 'NEW_CHANGED'
+    }
+
+
+def test_scratch_single_prefix_is_scoped_import(fsx_client):
+    app.create_file_system({**BASE_EVENT, 'prefixes': ['/train/'], 'import_policy': 'NONE'})
+
+    kwargs: dict = fsx_client.create_file_system.call_args.kwargs
+    assert kwargs['LustreConfiguration']['ImportPath'] == 's3://my-bucket/teamA/train/'
+    assert kwargs['LustreConfiguration']['AutoImportPolicy'] == 'NONE'
+
+
+@pytest.mark.parametrize('settings', [
+    {'prefixes': ['train']},
+    {'import_policy': 'NONE'},
+    {'deployment_type': 'PERSISTENT_2'}
+])
+def test_non_default_settings_change_token(fsx_client, settings):
+    app.create_file_system({**BASE_EVENT, **settings})
+
+    token: str = fsx_client.create_file_system.call_args.kwargs['ClientRequestToken']
+    assert token.startswith('teamA-my-bucket-')
+    assert len(token) == len('teamA-my-bucket-') + 8
+
+
+def test_token_is_truncated(fsx_client):
+    app.create_file_system({'team': 'teamA', 'bucket': 'b' * 80, 'import_policy': 'NONE'})
+
+    token: str = fsx_client.create_file_system.call_args.kwargs['ClientRequestToken']
+    assert len(token) == app.MAX_TOKEN_LENGTH
+
+
+@pytest.mark.parametrize('settings', [
+    {'prefixes': ['a', 'b']},
+    {'prefixes': 'abc'},
+    {'prefixes': [1]},
+    {'deployment_type': 'PERSISTENT_1'},
+    {'import_policy': 'ALL'},
+    {'critical_prefixes': ['a']},
+    {'prefixes': ['a', 'b'], 'critical_prefixes': ['c'], 'deployment_type': 'PERSISTENT_2'},
+    {'prefixes': [str(i) for i in range(9)], 'deployment_type': 'PERSISTENT_2'}
+])
+def test_invalid_settings_are_rejected_before_create(fsx_client, settings):
+    with pytest.raises(ValueError):
+        app.create_file_system({**BASE_EVENT, **settings})
+
+    fsx_client.create_file_system.assert_not_called()
+
+
+def test_get_prefixes_normalizes():
+    assert app.get_prefixes({'prefixes': ['/b/', 'a', 'a/']}) == ['a', 'b']
+    assert app.get_prefixes({'prefixes': ['/']}) == ['']
+    assert not app.get_prefixes({})
+
+
+@pytest.mark.parametrize('prefixes', [['a', 'a/b'], ['', 'a']])
+def test_get_prefixes_rejects_nested(prefixes):
+    with pytest.raises(ValueError):
+        app.get_prefixes({'prefixes': prefixes})
+
+
+def test_get_critical_prefixes_defaults_to_imported():
+    assert app.get_critical_prefixes({}, ['a', 'b']) == ['a', 'b']
+    assert app.get_critical_prefixes({}, []) == ['']
+    assert app.get_critical_prefixes({'critical_prefixes': ['/a']}, ['a', 'b']) == ['a']
+
+
+def test_status_scratch_reports_repository_lifecycle(fsx_client):
+    describe(fsx_client, 'CREATING', 'SCRATCH_2')
+
+    assert app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1'}) == {
+        'status': 'CREATING', 'prefixes': {'': 'CREATING'}
+    }
+
+
+@pytest.mark.parametrize('lifecycle, expected', [
+    ('CREATING', 'CREATING'),
+    ('MISCONFIGURED_UNAVAILABLE', 'MISCONFIGURED')
+])
+def test_status_persistent_waits_for_file_system(fsx_client, lifecycle, expected):
+    describe(fsx_client, lifecycle)
+
+    assert app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1', 'prefixes': ['a']}) == {
+        'status': expected, 'prefixes': {'a': 'PENDING'}
+    }
+    fsx_client.create_data_repository_association.assert_not_called()
+
+
+def test_status_creates_missing_associations(fsx_client):
+    describe(fsx_client, 'AVAILABLE')
+    fsx_client.get_paginator.return_value.paginate.return_value = [
+        {'Associations': [{'FileSystemPath': '/a', 'Lifecycle': 'AVAILABLE'}]}
+    ]
+    fsx_client.create_data_repository_association.return_value = {
+        **OK, 'Association': {'Lifecycle': 'CREATING'}
+    }
+
+    status: dict = app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1',
+                                   'prefixes': ['a', 'b'], 'critical_prefixes': ['a'],
+                                   'import_policy': 'NEW'})
+
+    assert status == {'status': 'AVAILABLE', 'prefixes': {'a': 'AVAILABLE', 'b': 'CREATING'}}
+    kwargs: dict = fsx_client.create_data_repository_association.call_args.kwargs
+    assert kwargs['FileSystemPath'] == '/b'
+    assert kwargs['DataRepositoryPath'] == 's3://my-bucket/teamA/b/'
+    assert kwargs['S3'] == {'AutoImportPolicy': {'Events': ['NEW']}}
+
+
+@pytest.mark.parametrize('states, expected', [
+    (['AVAILABLE', 'AVAILABLE'], 'AVAILABLE'),
+    (['AVAILABLE', 'CREATING'], 'CREATING'),
+    (['AVAILABLE', 'MISCONFIGURED'], 'MISCONFIGURED'),
+    (['CREATING', 'FAILED'], 'MISCONFIGURED')
+])
+def test_status_aggregates_critical_prefixes(fsx_client, states, expected):
+    describe(fsx_client, 'AVAILABLE')
+    fsx_client.get_paginator.return_value.paginate.return_value = [{'Associations': [
+        {'FileSystemPath': '/a', 'Lifecycle': states[0]},
+        {'FileSystemPath': '/b', 'Lifecycle': states[1]}
+    ]}]
+
+    status: dict = app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1',
+                                   'prefixes': ['a', 'b']})
+
+    assert status['status'] == expected
+
+
+def test_status_rejects_unknown_critical_prefix(fsx_client):
+    describe(fsx_client, 'AVAILABLE')
+
+    with pytest.raises(ValueError):
+        app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1',
+                        'prefixes': ['a'], 'critical_prefixes': ['c']})
+
+
+@pytest.mark.parametrize('code, expected_prefix, expected_status', [
+    ('BadRequest', 'FAILED', 'MISCONFIGURED'),
+    ('IncompatibleParameterError', 'FAILED', 'MISCONFIGURED'),
+    ('ThrottlingException', 'CREATING', 'CREATING'),
+    ('InternalServerError', 'CREATING', 'CREATING'),
+    ('ServiceLimitExceeded', 'CREATING', 'CREATING')
+])
+def test_association_errors(fsx_client, code, expected_prefix, expected_status):
+    describe(fsx_client, 'AVAILABLE')
+    fsx_client.create_data_repository_association.side_effect = client_error(code)
+
+    status: dict = app.get_status({**BASE_EVENT, 'file_system_id': 'fs-1', 'prefixes': ['a']})
+
+    assert status == {'status': expected_status, 'prefixes': {'a': expected_prefix}}